@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+watch_azabu.py の差分計算・イベント発行・イベントストリームのテスト
+（LINE通知は差し替え、監視対象サイトへのアクセスは行わない）
+
+実行: python test_watch_azabu.py  または  python -m pytest test_watch_azabu.py
+"""
+
+import http.client
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import types
+from contextlib import ExitStack, contextmanager
+from http.server import ThreadingHTTPServer
+from unittest.mock import patch
+
+import watch_azabu
+from watch_azabu import EventHub, EventStreamHandler, diff_summary, slot_changes
+
+OLD_CALENDAR = "3月 8日 ×\n3月 9日 ○\n3月 15日 △"
+NEW_CALENDAR = "3月 8日 ○\n3月 15日 △\n3月 16日 ○"
+
+
+def test_diff_summary():
+    """差分の要約が 新規→変更→削除 の順で出力されること"""
+    assert diff_summary(OLD_CALENDAR, NEW_CALENDAR) == (
+        "【新規】3月 16日 ○\n"
+        "【変更】3月 8日 × → 3月 8日 ○\n"
+        "【削除】3月 9日 ○"
+    )
+    assert diff_summary(OLD_CALENDAR, OLD_CALENDAR) == ""
+    assert diff_summary("", "3月 8日 ○") == "【新規】3月 8日 ○"
+
+
+def test_diff_summary_limit():
+    """差分は最大20件まで"""
+    new_text = "\n".join(f"4月 {d}日 ○" for d in range(1, 31))
+    assert len(diff_summary("", new_text).splitlines()) == 20
+
+
+def test_slot_changes():
+    assert slot_changes(OLD_CALENDAR, NEW_CALENDAR) == [
+        ("added", "3月 16日", "", "3月 16日 ○"),
+        ("changed", "3月 8日", "3月 8日 ×", "3月 8日 ○"),
+        ("removed", "3月 9日", "3月 9日 ○", ""),
+    ]
+
+
+def test_events_after_replay():
+    hub = EventHub()
+    first = hub.publish("opening_detected", {})
+    second = hub.publish("slot_added", {"date": "3月 8日"})
+    assert [e["id"] for e in hub.events_after(0)] == [first["id"], second["id"]]
+    assert hub.events_after(first["id"]) == [second]
+    assert hub.replay_gap(first["id"]) is None
+
+
+def test_events_after_timeout():
+    hub = EventHub()
+    event = hub.publish("opening_detected", {})
+    start = time.time()
+    assert hub.events_after(event["id"], timeout=0.2) == []
+    assert time.time() - start >= 0.2
+
+
+def test_events_after_wakes_on_publish():
+    hub = EventHub()
+    last = hub.publish("opening_detected", {})
+    threading.Timer(0.1, hub.publish, args=("fetch_error", {})).start()
+    events = hub.events_after(last["id"], timeout=5)
+    assert [e["type"] for e in events] == ["fetch_error"]
+
+
+def test_events_after_close():
+    hub = EventHub()
+    threading.Timer(0.1, hub.close).start()
+    start = time.time()
+    assert hub.events_after(0, timeout=5) == []
+    assert time.time() - start < 5
+    assert hub.closed
+
+
+def test_ids_increase_across_restarts():
+    """スプール無しで再起動しても、前回のIDより大きいIDが振られること"""
+    old_id = EventHub().publish("opening_detected", {})["id"]
+    time.sleep(0.01)
+    hub = EventHub()
+    new_id = hub.publish("opening_detected", {})["id"]
+    assert new_id > old_id
+    assert [e["id"] for e in hub.events_after(old_id)] == [new_id]
+
+
+def test_replay_gap():
+    hub = EventHub(buffer_size=2)
+    events = [hub.publish("slot_added", {"n": i}) for i in range(3)]
+    # バッファから溢れたIDは truncated
+    assert hub.replay_gap(events[0]["id"] - 1) == "truncated"
+    assert hub.replay_gap(events[0]["id"]) is None
+    # 現在の系列より新しいIDは unknown
+    assert hub.replay_gap(events[-1]["id"] + 1) == "unknown"
+    assert hub.replay_gap(0) is None
+
+
+def test_spool_restore_skips_invalid_lines():
+    with tempfile.TemporaryDirectory() as tmp:
+        spool = os.path.join(tmp, "events.jsonl")
+        with open(spool, "w", encoding="utf-8") as f:
+            f.write("[1]\n")
+            f.write("not json\n")
+            f.write('{"type": "no_id"}\n')
+            for i in range(1, 6):
+                f.write(json.dumps({"id": i, "type": "slot_added", "data": {}}) + "\n")
+
+        hub = EventHub(spool_file=spool, buffer_size=3)
+        assert [e["id"] for e in hub.events_after(0)] == [3, 4, 5]
+        assert hub.publish("fetch_error", {})["id"] > 5
+
+        # 保持件数を超えた分は切り詰められる
+        with open(spool, "r", encoding="utf-8") as f:
+            assert [json.loads(line)["id"] for line in f][:3] == [3, 4, 5]
+
+
+@contextmanager
+def monitor_env(**stubs):
+    """データ保存先を一時ディレクトリに切り替え、LINE送信と指定した関数を差し替えて run_once を動かす"""
+    with tempfile.TemporaryDirectory() as tmp, ExitStack() as stack:
+        stack.enter_context(patch.object(watch_azabu, "DATA_DIR", tmp))
+        for name in ["SNAP_FILE", "RAW_FILE", "STATE_FILE", "LOG_FILE"]:
+            path = os.path.join(tmp, os.path.basename(getattr(watch_azabu, name)))
+            stack.enter_context(patch.object(watch_azabu, name, path))
+        stack.enter_context(patch.object(watch_azabu, "line_broadcast", lambda text: True))
+        for name, side_effect in stubs.items():
+            stack.enter_context(patch.object(watch_azabu, name, side_effect=side_effect))
+        hub = EventHub()
+        stack.enter_context(patch.object(watch_azabu, "event_hub", hub))
+        yield hub
+
+
+def test_run_once_events():
+    """run_once が取得失敗・受付開始・枠の変化をイベントとして発行すること"""
+    pages = [("error", "timed out"), ("not_available", "予約を受け付けておりません"), ("available", ""), ("available", "")]
+    calendars = [(OLD_CALENDAR, ""), (NEW_CALENDAR, "")]
+    with monitor_env(check_page_with_requests=pages, check_calendar_with_playwright=calendars) as hub:
+        for _ in pages:
+            assert watch_azabu.run_once()
+        events = [(e["type"], e["data"]) for e in hub.events_after(0)]
+
+    url = watch_azabu.URL
+    assert events == [
+        ("fetch_error", {"source": "requests", "url": url, "error": "timed out"}),
+        ("opening_detected", {"url": url}),
+        # 受付開始前（prev_raw == "not_available"）からの初回取得は全て新規扱い
+        ("slot_added", {"date": "3月 8日", "before": "", "after": "3月 8日 ×"}),
+        ("slot_added", {"date": "3月 9日", "before": "", "after": "3月 9日 ○"}),
+        ("slot_added", {"date": "3月 15日", "before": "", "after": "3月 15日 △"}),
+        # 2回目以降は前回との差分
+        ("slot_added", {"date": "3月 16日", "before": "", "after": "3月 16日 ○"}),
+        ("slot_changed", {"date": "3月 8日", "before": "3月 8日 ×", "after": "3月 8日 ○"}),
+        ("slot_removed", {"date": "3月 9日", "before": "3月 9日 ○", "after": ""}),
+    ]
+
+
+def test_run_once_playwright_errors():
+    """Playwright の例外では fetch_error を発行し、未インストールでは発行しないこと"""
+    def broken_sync_playwright():
+        raise RuntimeError("browser crashed")
+
+    sync_api = types.ModuleType("playwright.sync_api")
+    sync_api.sync_playwright = broken_sync_playwright
+    sync_api.TimeoutError = Exception
+
+    pages = [("available", ""), ("available", "")]
+    with monitor_env(check_page_with_requests=pages) as hub:
+        with patch.dict(sys.modules, {"playwright": None}):
+            watch_azabu.run_once()
+        with patch.dict(sys.modules, {"playwright": types.ModuleType("playwright"), "playwright.sync_api": sync_api}):
+            watch_azabu.run_once()
+        events = [(e["type"], e["data"]) for e in hub.events_after(0)]
+
+    assert events == [
+        ("opening_detected", {"url": watch_azabu.URL}),
+        ("fetch_error", {"source": "playwright", "url": watch_azabu.URL, "error": "browser crashed"}),
+    ]
+
+
+@contextmanager
+def sse_server(hub):
+    """空きポートでSSEサーバーを起動"""
+    handler = type("Handler", (EventStreamHandler,), {"hub": hub})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield server.server_address[1]
+    finally:
+        hub.close()
+        server.shutdown()
+        server.server_close()
+
+
+def open_stream(port, path="/events", headers=None):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    conn.request("GET", path, headers=headers or {})
+    resp = conn.getresponse()
+    assert resp.status == 200
+    assert resp.getheader("Content-Type").startswith("text/event-stream")
+    return resp
+
+
+def read_messages(resp, count):
+    """SSEメッセージを count 件読み、フィールドの辞書として返す（コメント行は無視）"""
+    messages = []
+    fields = {}
+    while len(messages) < count:
+        line = resp.fp.readline().decode("utf-8").rstrip("\n")
+        if not line:
+            if fields:
+                messages.append(fields)
+                fields = {}
+            continue
+        if line.startswith(":"):
+            continue
+        name, _, value = line.partition(": ")
+        fields[name] = value
+    return messages
+
+
+def test_sse_framing_and_live_tail():
+    """Last-Event-ID 無しでは接続以降のイベントのみ、id/event/data 形式で届くこと"""
+    hub = EventHub()
+    hub.publish("opening_detected", {"url": "old"})
+    with sse_server(hub) as port:
+        resp = open_stream(port)
+        event = hub.publish("slot_added", {"date": "3月 8日"})
+        [message] = read_messages(resp, 1)
+
+    assert message["id"] == str(event["id"])
+    assert message["event"] == "slot_added"
+    assert json.loads(message["data"]) == event
+
+
+def test_sse_replay_from_last_event_id():
+    """Last-Event-ID ヘッダ・last_event_id クエリの続きからリプレイされること"""
+    hub = EventHub()
+    first, second, third = [hub.publish("slot_added", {"n": i}) for i in range(3)]
+    with sse_server(hub) as port:
+        by_header = read_messages(open_stream(port, headers={"Last-Event-ID": str(first["id"])}), 2)
+        by_query = read_messages(open_stream(port, path=f"/events?last_event_id={second['id']}"), 1)
+
+    assert [m["id"] for m in by_header] == [str(second["id"]), str(third["id"])]
+    assert [m["id"] for m in by_query] == [str(third["id"])]
+
+
+def test_sse_reset():
+    """続きを再送できないIDでは reset の後にバッファ全体が届くこと"""
+    hub = EventHub(buffer_size=2)
+    events = [hub.publish("slot_added", {"n": i}) for i in range(3)]
+    with sse_server(hub) as port:
+        truncated = read_messages(open_stream(port, headers={"Last-Event-ID": str(events[0]["id"] - 1)}), 3)
+        unknown = read_messages(open_stream(port, headers={"Last-Event-ID": str(events[-1]["id"] + 100)}), 3)
+
+    for messages, reason in [(truncated, "truncated"), (unknown, "unknown")]:
+        assert messages[0]["event"] == "reset"
+        assert json.loads(messages[0]["data"])["reason"] == reason
+        assert [m["id"] for m in messages[1:]] == [str(e["id"]) for e in events[1:]]
+
+
+if __name__ == "__main__":
+    tests = [(name, fn) for name, fn in sorted(globals().items()) if name.startswith("test_") and callable(fn)]
+    failed = 0
+    for name, fn in tests:
+        try:
+            fn()
+            print(f"OK   {name}")
+        except AssertionError as e:
+            failed += 1
+            print(f"FAIL {name}: {e}")
+    print("=" * 50)
+    print(f"{len(tests) - failed}/{len(tests)} 件成功")
+    raise SystemExit(1 if failed else 0)
@@ -14,7 +14,11 @@ import os
 import hashlib
 import time
 import json
+import threading
+from collections import deque
 from datetime import datetime, timezone, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
 from dotenv import load_dotenv
 import requests
 import glob as glob_module
@@ -27,6 +31,15 @@ TOKEN = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
 URL = os.getenv("TARGET_URL_AZABU", "https://www.31sumai.com/attend/X2571/")
 CHECK_INTERVAL = int(os.getenv("CHECK_INTERVAL", "2"))
 
+# イベントストリーム設定（ポート0 / スプール未指定で無効）
+EVENT_STREAM_HOST = os.getenv("EVENT_STREAM_HOST", "127.0.0.1")
+EVENT_STREAM_PORT = int(os.getenv("EVENT_STREAM_PORT", "0"))
+EVENT_SPOOL_FILE = os.getenv("EVENT_SPOOL_FILE", "")
+EVENT_BUFFER_SIZE = 1000  # 再接続時のリプレイ用に保持するイベント数
+EVENT_KEEPALIVE_SEC = 15
+EVENT_CLIENT_TIMEOUT_SEC = 60  # 受信しなくなったクライアントを切断するまでの時間
+SIMULATE_STREAM_SEC = 60  # シミュレーション後にイベント配信を続ける時間
+
 # データ保存ディレクトリ
 DATA_DIR = "./data"
 SNAP_FILE = os.path.join(DATA_DIR, "snapshot_hash_azabu.txt")
@@ -101,39 +114,54 @@ def cleanup_screenshots():
         pass
 
 
-def diff_summary(old_text, new_text):
-    """予約枠の差分を人間にわかりやすく要約"""
-    old_lines = old_text.strip().splitlines() if old_text else []
-    new_lines = new_text.strip().splitlines() if new_text else []
+def parse_slots(text):
+    """カレンダーテキストから 日付→行 の辞書を作成"""
+    slots = {}
+    for line in (text.strip().splitlines() if text else []):
+        line = line.strip()
+        if line:
+            slots[line.rsplit(" ", 1)[0] if " " in line else line] = line
+    return slots
 
-    # 日付→ステータスの辞書を作成
-    def parse_slots(lines):
-        slots = {}
-        for line in lines:
-            line = line.strip()
-            if line:
-                slots[line.rsplit(" ", 1)[0] if " " in line else line] = line
-        return slots
 
-    old_slots = parse_slots(old_lines)
-    new_slots = parse_slots(new_lines)
+def slot_changes(old_text, new_text):
+    """
+    予約枠の差分を列挙
+    戻り値: [("added" | "changed" | "removed", 日付, 変更前の行, 変更後の行), ...]
+    """
+    old_slots = parse_slots(old_text)
+    new_slots = parse_slots(new_text)
 
     changes = []
 
     # 新規追加
     for key in new_slots:
         if key not in old_slots:
-            changes.append(f"【新規】{new_slots[key]}")
+            changes.append(("added", key, "", new_slots[key]))
 
     # 変更
     for key in new_slots:
         if key in old_slots and old_slots[key] != new_slots[key]:
-            changes.append(f"【変更】{old_slots[key]} → {new_slots[key]}")
+            changes.append(("changed", key, old_slots[key], new_slots[key]))
 
     # 削除
     for key in old_slots:
         if key not in new_slots:
-            changes.append(f"【削除】{old_slots[key]}")
+            changes.append(("removed", key, old_slots[key], ""))
+
+    return changes
+
+
+def diff_summary(old_text, new_text):
+    """予約枠の差分を人間にわかりやすく要約"""
+    changes = []
+    for kind, _key, old, new in slot_changes(old_text, new_text):
+        if kind == "added":
+            changes.append(f"【新規】{new}")
+        elif kind == "changed":
+            changes.append(f"【変更】{old} → {new}")
+        else:
+            changes.append(f"【削除】{old}")
 
     return "\n".join(changes[:20]) if changes else ""
 
@@ -172,10 +200,233 @@ def line_broadcast(text):
         return False
 
 
+class EventHub:
+    """
+    検知イベントの配信ハブ
+    直近のイベントをメモリに保持し、SSEクライアントへのファンアウトと
+    JSONLスプールへの追記を行う。publish は待機中のクライアントを起こすだけで、
+    クライアントへの送信は各接続のスレッドが行うため監視ループをブロックしない。
+    """
+
+    def __init__(self, spool_file="", buffer_size=EVENT_BUFFER_SIZE):
+        self._events = deque(maxlen=buffer_size)
+        self._cond = threading.Condition()
+        # IDはプロセス起動時刻（ミリ秒）から採番し、再起動後も前回より大きくなるようにする
+        self._next_id = int(time.time() * 1000)
+        self._closed = False
+        self._spool_file = spool_file
+        if spool_file:
+            self._load_spool()
+
+    def _load_spool(self):
+        """スプールから直近のイベントを復元（再起動後もLast-Event-IDでリプレイ可能にする）"""
+        try:
+            total = 0
+            tail = deque(maxlen=self._events.maxlen)
+            with open(self._spool_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    total += 1
+                    tail.append(line)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            log_message(f"イベントスプール読み込みエラー: {e}")
+            return
+
+        for line in tail:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            # 形式が不正な行は読み飛ばす
+            if not isinstance(event, dict) or not isinstance(event.get("id"), int) or "type" not in event:
+                continue
+            self._events.append(event)
+            self._next_id = max(self._next_id, event["id"] + 1)
+
+        # 保持件数を超えた分は切り詰め、スプールが際限なく肥大しないようにする
+        if total > len(tail):
+            try:
+                tmp_file = self._spool_file + ".tmp"
+                with open(tmp_file, "w", encoding="utf-8") as f:
+                    for event in self._events:
+                        f.write(json.dumps(event, ensure_ascii=False) + "\n")
+                os.replace(tmp_file, self._spool_file)
+            except Exception as e:
+                log_message(f"イベントスプール整理エラー: {e}")
+
+    def publish(self, event_type, data):
+        """イベントを発行"""
+        with self._cond:
+            event = {
+                "id": self._next_id,
+                "type": event_type,
+                "time": jst_now(),
+                "data": data,
+            }
+            self._next_id += 1
+            self._events.append(event)
+            self._cond.notify_all()
+
+        if self._spool_file:
+            try:
+                with open(self._spool_file, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(event, ensure_ascii=False) + "\n")
+            except Exception as e:
+                log_message(f"イベントスプール書き込みエラー: {e}")
+        return event
+
+    def events_after(self, last_id, timeout=None):
+        """last_id より新しいイベントを返す。無ければ timeout 秒まで待機"""
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._closed or (self._events and self._events[-1]["id"] > last_id),
+                timeout=timeout,
+            )
+            return [e for e in self._events if e["id"] > last_id]
+
+    def replay_gap(self, last_id):
+        """
+        last_id 以降のイベントを完全にはリプレイできない場合にその理由を返す（問題なければ None）
+        "unknown": 現在の系列に存在しないID / "truncated": バッファから溢れたイベントがある
+        """
+        if not last_id:
+            return None
+        with self._cond:
+            if last_id >= self._next_id:
+                return "unknown"
+            oldest_id = self._events[0]["id"] if self._events else self._next_id
+            if last_id < oldest_id - 1:
+                return "truncated"
+        return None
+
+    def replay(self, last_id):
+        """
+        接続直後のリプレイ用に、取りこぼし判定と読み出しを同じロック内で行う
+        戻り値: (replay_gap の結果, 送信するイベント)  ※取りこぼしがあればバッファ全体
+        """
+        with self._cond:
+            gap = self.replay_gap(last_id)
+            if gap:
+                last_id = 0
+            return gap, [e for e in self._events if e["id"] > last_id]
+
+    @property
+    def latest_id(self):
+        """最後に発行した（または発行済みとみなす）イベントID"""
+        with self._cond:
+            return self._next_id - 1
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def close(self):
+        """待機中のクライアントを解放"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class EventStreamHandler(BaseHTTPRequestHandler):
+    """GET /events でイベントをServer-Sent Eventsとして配信"""
+
+    hub = None
+    timeout = EVENT_CLIENT_TIMEOUT_SEC
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        if parsed.path != "/events":
+            self.send_error(404)
+            return
+
+        # Last-Event-ID ヘッダ（またはクエリ）が指定された場合のみ、その続きをリプレイ。
+        # 指定が無ければ過去のイベントは送らず、接続以降の新しいイベントだけを配信する
+        last_id = self.headers.get("Last-Event-ID") or parse_qs(parsed.query).get("last_event_id", [""])[0]
+        try:
+            last_id = int(last_id)
+        except ValueError:
+            last_id = self.hub.latest_id
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+
+        try:
+            # 取りこぼしがある場合は reset を送り、バッファの先頭から送り直す
+            gap, events = self.hub.replay(last_id)
+            if gap:
+                payload = json.dumps({"reason": gap, "last_event_id": last_id})
+                self.wfile.write(f"event: reset\ndata: {payload}\n\n".encode("utf-8"))
+                last_id = 0
+
+            while True:
+                for event in events:
+                    payload = json.dumps(event, ensure_ascii=False)
+                    self.wfile.write(
+                        f"id: {event['id']}\nevent: {event['type']}\ndata: {payload}\n\n".encode("utf-8")
+                    )
+                    last_id = event["id"]
+                self.wfile.flush()
+
+                if self.hub.closed:
+                    break
+                events = self.hub.events_after(last_id, timeout=EVENT_KEEPALIVE_SEC)
+                if not events and not self.hub.closed:
+                    # 切断検知を兼ねたキープアライブ
+                    self.wfile.write(b": keepalive\n\n")
+        except OSError:
+            # クライアント切断（BrokenPipe / ConnectionReset / タイムアウト等）
+            pass
+
+    def log_message(self, format, *args):
+        """アクセスログは出力しない"""
+        pass
+
+
+event_hub = None
+
+
+def start_event_stream(spool_file=EVENT_SPOOL_FILE):
+    """イベントハブとSSEサーバーを起動（設定が無ければ何もしない）"""
+    global event_hub
+    if not EVENT_STREAM_PORT and not spool_file:
+        return
+
+    event_hub = EventHub(spool_file=spool_file)
+    if spool_file:
+        log_message(f"イベントスプール: {spool_file}")
+
+    if EVENT_STREAM_PORT:
+        EventStreamHandler.hub = event_hub
+        try:
+            server = ThreadingHTTPServer((EVENT_STREAM_HOST, EVENT_STREAM_PORT), EventStreamHandler)
+        except OSError as e:
+            log_message(f"イベントストリーム起動失敗: {e}")
+            return
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        log_message(f"イベントストリーム: http://{EVENT_STREAM_HOST}:{EVENT_STREAM_PORT}/events")
+
+
+def stop_event_stream():
+    """接続中のクライアントへの配信を終了"""
+    if event_hub:
+        event_hub.close()
+
+
+def emit_event(event_type, data):
+    """イベントを発行（イベントストリーム無効時は何もしない）"""
+    if event_hub:
+        event_hub.publish(event_type, data)
+
+
 def check_page_with_requests():
     """
     requestsで軽量チェック（Phase 1）
-    戻り値: ("not_available" | "available" | "error", ページテキスト)
+    戻り値: ("not_available" | "available" | "error", ページテキスト)  ※"error" の場合はエラー内容
     """
     try:
         resp = requests.get(URL, headers=HEADERS, timeout=15)
@@ -189,19 +440,20 @@ def check_page_with_requests():
 
     except requests.RequestException as e:
         log_message(f"ページ取得エラー: {e}")
-        return "error", ""
+        return "error", str(e)
 
 
 def check_calendar_with_playwright():
     """
     Playwrightでカレンダー詳細を取得（Phase 2）
     予約が開始された後、カレンダーの空き状況を取得する
+    戻り値: (カレンダーテキスト, エラー内容)  ※取得失敗時のみエラー内容が入る
     """
     try:
         from playwright.sync_api import sync_playwright, TimeoutError as PWTimeout
     except ImportError:
         log_message("Playwright未インストール。requestsの結果のみで通知します。")
-        return ""
+        return "", ""
 
     try:
         with sync_playwright() as p:
@@ -242,11 +494,11 @@ def check_calendar_with_playwright():
             context.close()
             browser.close()
 
-            return calendar_text
+            return calendar_text, ""
 
     except Exception as e:
         log_message(f"Playwright処理エラー: {e}")
-        return ""
+        return "", str(e)
 
 
 def extract_calendar(page):
@@ -330,6 +582,20 @@ def test_simulate():
     """予約受付開始を模擬し、本番と同じ通知フローをテスト"""
     log_message("シミュレーションモードで実行（予約開始を模擬）")
 
+    # ダミーのカレンダーデータ
+    dummy_calendar = [
+        "3月 8日 ○",
+        "3月 9日 △",
+        "3月 15日 ×",
+        "3月 16日 ○",
+        "3月 22日 ×",
+    ]
+
+    # イベントストリームにも本番と同じ種類のイベントを発行
+    emit_event("opening_detected", {"url": URL, "simulated": True})
+    for kind, key, old, new in slot_changes("", "\n".join(dummy_calendar)):
+        emit_event(f"slot_{kind}", {"date": key, "before": old, "after": new, "simulated": True})
+
     # 速報通知（本番と同じメッセージ）
     urgent_message = f"""【⚠️テスト】【速報】パークコート麻布十番東京
 予約受付が開始されました！
@@ -350,14 +616,6 @@ def test_simulate():
         return
 
     # カレンダー詳細通知（ダミーデータ）
-    dummy_calendar = [
-        "3月 8日 ○",
-        "3月 9日 △",
-        "3月 15日 ×",
-        "3月 16日 ○",
-        "3月 22日 ×",
-    ]
-
     message_parts = [
         "【⚠️テスト】【予約枠情報】パークコート麻布十番東京",
         "",
@@ -409,6 +667,7 @@ def run_once():
 
     if status == "error":
         log_message("ページ取得に失敗しました。次回のチェックで再試行します。")
+        emit_event("fetch_error", {"source": "requests", "url": URL, "error": page_body})
         return True  # エラーでもループ継続
 
     # ── まだ受付開始前 ──
@@ -434,6 +693,7 @@ def run_once():
     # ── Phase 2: 初回検知 → 速報通知 ──
     if is_first_detection:
         log_message("★★★ 予約受付が開始されました！ ★★★")
+        emit_event("opening_detected", {"url": URL})
 
         urgent_message = f"""【速報】パークコート麻布十番東京
 予約受付が開始されました！
@@ -452,10 +712,12 @@ def run_once():
         log_message("受付中（継続監視）")
 
     # ── Phase 3: Playwrightでカレンダー詳細を取得 ──
-    calendar_text = check_calendar_with_playwright()
+    calendar_text, calendar_error = check_calendar_with_playwright()
 
     if not calendar_text:
         log_message("カレンダー詳細を取得できませんでした")
+        if calendar_error:
+            emit_event("fetch_error", {"source": "playwright", "url": URL, "error": calendar_error})
         if is_first_detection:
             log_message("速報は送信済みです")
         save_state("available")
@@ -470,6 +732,11 @@ def run_once():
     log_message(f"カレンダー変化: {'あり' if changed else 'なし'}")
 
     if is_first_detection or changed:
+        # 枠ごとの変化をイベントとして発行
+        base_raw = prev_raw if prev_raw != "not_available" else ""
+        for kind, key, old, new in slot_changes(base_raw, calendar_text):
+            emit_event(f"slot_{kind}", {"date": key, "before": old, "after": new})
+
         # 差分を計算
         diff = ""
         if not is_first_detection and prev_raw and prev_raw != "not_available":
@@ -548,7 +815,14 @@ def main():
         test_notification()
         return
     if test_mode == "simulate":
+        # 模擬イベントが本番のスプールに残らないよう、スプールは使わない
+        start_event_stream(spool_file="")
         test_simulate()
+        if EVENT_STREAM_PORT:
+            # ダッシュボード等から接続・リプレイできるよう、しばらく配信を継続
+            log_message(f"イベントストリーム確認用に{SIMULATE_STREAM_SEC}秒間配信を継続します")
+            time.sleep(SIMULATE_STREAM_SEC)
+        stop_event_stream()
         return
 
     log_message("=" * 50)
@@ -557,6 +831,8 @@ def main():
     log_message(f"ループ: {LOOP_DURATION_MIN}分間、{CHECK_INTERVAL}分間隔")
     log_message("=" * 50)
 
+    start_event_stream()
+
     start_time = time.time()
     end_time = start_time + LOOP_DURATION_MIN * 60
     check_count = 0
@@ -585,6 +861,7 @@ def main():
             break
 
     log_message(f"監視ループ終了（{check_count}回チェック実施）")
+    stop_event_stream()
 
 
 if __name__ == "__main__":